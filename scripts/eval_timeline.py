@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Golden-Day Evaluation Harness
+
+Replays a corpus of recorded day inputs through TimelineFormatter and scores
+the output against hand-checked expected timelines, so prompt or model
+changes can be compared on latency, tokens and quality instead of blindly.
+
+Usage:
+    # Offline: replay the recorded responses stored in each fixture
+    python eval_timeline.py
+
+    # Live: call real models (repeat --model to compare configurations)
+    python eval_timeline.py --model claude-sonnet-4-20250514 --model claude-haiku-4-5
+
+    # Live, and store the responses as the fixtures' new recordings
+    python eval_timeline.py --model claude-sonnet-4-20250514 --record
+
+    # Turn a run journal into a new fixture (then hand-check "expected")
+    python eval_timeline.py --from-journal .timeline-journal/2026-01-17.json --name 2026-01-17
+
+Fixtures live in scripts/golden_days/*.json:
+    {
+      "name": "...",
+      "synthetic": false,   # true for hand-made fixtures that are not real days
+      "yesterday_entries": [{"uid": "...", "content": "...", "order": 0}, ...],
+      "today_entries": [...],
+      "expected": {"yesterday": ["HH:MM - HH:MM (**d**) - ... #[[Tag]]", ...], "today": [...]},
+      "recorded": {"response_text": "...", "model": "...", "ttft": 1.2, "latency": 9.8,
+                   "input_tokens": 0, "output_tokens": 0, "cache_read_input_tokens": 0}
+    }
+"""
+
+import os
+import sys
+import copy
+import json
+import glob
+import argparse
+from types import SimpleNamespace
+from typing import Optional
+
+from format_timeline_agent import (
+    FORMATTED_ENTRY_RE,
+    TagIndex,
+    TimelineFormatter,
+    TimelineJournal,
+    calculate_duration,
+    format_duration,
+    get_last_end_time,
+    repair_timeline,
+    split_activity_and_tags,
+)
+
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden_days")
+USAGE_KEYS = ["input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"]
+
+
+class _RecordedStream:
+    """Stand-in for the SDK's MessageStream that replays a recorded response."""
+
+    def __init__(self, recorded: dict):
+        self.recorded = recorded
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        yield SimpleNamespace(type="content_block_delta")
+
+    def get_final_message(self):
+        usage = {key: self.recorded.get(key, 0) for key in USAGE_KEYS}
+        return SimpleNamespace(
+            id="recorded",
+            content=[SimpleNamespace(type="text", text=self.recorded["response_text"])],
+            usage=SimpleNamespace(**usage),
+        )
+
+
+class RecordedClient:
+    """Offline messages endpoint: answers every request with a fixture's recording."""
+
+    def __init__(self, recorded: dict):
+        self.messages = SimpleNamespace(stream=lambda **kwargs: _RecordedStream(recorded))
+
+
+def load_fixtures(golden_dir: str, names: Optional[list[str]] = None) -> list[dict]:
+    """Load golden-day fixtures, optionally filtered by name."""
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(golden_dir, "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            fixture = json.load(f)
+        fixture["_path"] = path
+        fixture.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+        if not names or fixture["name"] in names:
+            fixtures.append(fixture)
+    return fixtures
+
+
+def parse_entry(string: str) -> Optional[dict]:
+    """Parse a formatted entry into start, end, stated duration and tags."""
+    match = FORMATTED_ENTRY_RE.match(string)
+    if not match:
+        return None
+    _, tags = split_activity_and_tags(string)
+    return {"start": match[1], "end": match[2], "duration": match[3], "tags": tags}
+
+
+def score_day(output: list[str], expected: list[str]) -> dict:
+    """Compare one day's output strings with the expected ones."""
+    out = [e for e in (parse_entry(s) for s in output) if e]
+    exp = [e for e in (parse_entry(s) for s in expected) if e]
+
+    # Split accuracy: F1 over (start, end) intervals
+    out_spans = {(e["start"], e["end"]): e for e in out}
+    exp_spans = {(e["start"], e["end"]): e for e in exp}
+    matched = out_spans.keys() & exp_spans.keys()
+
+    # Duration correctness: stated duration agrees with the time range
+    durations_ok = sum(
+        1 for e in out
+        if e["duration"] == format_duration(calculate_duration(e["start"], e["end"]))
+    )
+
+    # Tag agreement: on intervals both sides agree on
+    tags_ok = sum(1 for span in matched if out_spans[span]["tags"] == exp_spans[span]["tags"])
+
+    return {
+        "matched": len(matched),
+        "output": len(output),
+        "unparsed": len(output) - len(out),
+        "expected": len(exp_spans),
+        "durations_ok": durations_ok,
+        "tags_ok": tags_ok,
+    }
+
+
+def run_fixture(fixture: dict, model: Optional[str], tag_index: Optional[TagIndex]) -> dict:
+    """Run one fixture through TimelineFormatter and score the result.
+
+    The model's output is scored before the local repair pass; how much the
+    repair would have changed is reported separately.
+    """
+    if model:
+        formatter = TimelineFormatter(None, model=model)
+    else:
+        recorded = fixture.get("recorded")
+        if not recorded:
+            return {"name": fixture["name"], "error": "no recorded response"}
+        formatter = TimelineFormatter(None, RecordedClient(recorded), model=recorded.get("model"))
+    formatter.tag_index = tag_index
+
+    yesterday_entries = fixture.get("yesterday_entries", [])
+    today_entries = fixture.get("today_entries", [])
+    yesterday_last_end = fixture.get("yesterday_last_end") or get_last_end_time(yesterday_entries)
+
+    result = formatter.generate_timeline(
+        yesterday_entries,
+        yesterday_last_end,
+        today_entries,
+        "today-timeline",
+        "yesterday-timeline" if yesterday_entries else None,
+        repair=False
+    )
+
+    stats = dict(formatter.last_call_stats)
+    if not model:
+        # Replay timing is meaningless; report what was measured when recorded
+        stats["ttft"] = fixture["recorded"].get("ttft")
+        stats["latency"] = fixture["recorded"].get("latency")
+
+    report = {
+        "name": fixture["name"],
+        "stats": stats,
+        "response_text": formatter.last_response_text,
+    }
+    if result is None:
+        report["error"] = "unparseable response"
+        return report
+
+    report["repair_fixes"], report["repair_issues"] = repair_timeline(
+        copy.deepcopy(result), yesterday_last_end
+    )
+
+    report["output"] = {
+        day: [a["string"] for a in result.get(day, []) if "string" in a]
+        for day in ["yesterday", "today"]
+    }
+    expected = fixture.get("expected", {})
+    report["scores"] = {
+        day: score_day(report["output"][day], expected.get(day, []))
+        for day in ["yesterday", "today"]
+    }
+    return report
+
+
+def summarize(label: str, reports: list[dict]) -> dict:
+    """Aggregate fixture reports for one configuration."""
+    totals = {key: 0 for key in ["matched", "output", "unparsed", "expected", "durations_ok", "tags_ok"]}
+    for report in reports:
+        for day_scores in report.get("scores", {}).values():
+            for key in totals:
+                totals[key] += day_scores[key]
+
+    def mean(values):
+        values = [v for v in values if v is not None]
+        return sum(values) / len(values) if values else None
+
+    precision = totals["matched"] / totals["output"] if totals["output"] else 0.0
+    recall = totals["matched"] / totals["expected"] if totals["expected"] else 0.0
+    stats = [r.get("stats", {}) for r in reports]
+
+    return {
+        "config": label,
+        "fixtures": len(reports),
+        "errors": sum(1 for r in reports if "error" in r),
+        "ttft": mean(s.get("ttft") for s in stats),
+        "latency": mean(s.get("latency") for s in stats),
+        **{key: sum(s.get(key, 0) or 0 for s in stats) for key in USAGE_KEYS},
+        "split_f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        "duration_ok": totals["durations_ok"] / totals["output"] if totals["output"] else 0.0,
+        "tag_agreement": totals["tags_ok"] / totals["matched"] if totals["matched"] else 0.0,
+        # What the local repair pass would still have to fix / could not fix
+        "repairs": sum(len(r.get("repair_fixes", [])) for r in reports),
+        "unfixable": sum(len(r.get("repair_issues", [])) for r in reports),
+    }
+
+
+def print_summary(summaries: list[dict]):
+    """Print one row per configuration."""
+    def fmt_seconds(value):
+        return f"{value:.2f}s" if value is not None else "-"
+
+    header = f"{'config':<32} {'n':>3} {'err':>3} {'ttft':>7} {'total':>7} {'in':>7} {'out':>6} {'cached':>7} {'split':>6} {'dur':>6} {'tags':>6} {'fixes':>5} {'unfix':>5}"
+    print(header)
+    print("-" * len(header))
+    for s in summaries:
+        print(
+            f"{s['config']:<32} {s['fixtures']:>3} {s['errors']:>3} "
+            f"{fmt_seconds(s['ttft']):>7} {fmt_seconds(s['latency']):>7} "
+            f"{s['input_tokens']:>7} {s['output_tokens']:>6} {s['cache_read_input_tokens']:>7} "
+            f"{s['split_f1']:>6.1%} {s['duration_ok']:>6.1%} {s['tag_agreement']:>6.1%} "
+            f"{s['repairs']:>5} {s['unfixable']:>5}"
+        )
+
+
+def fixture_from_journal(journal_path: str, name: str, golden_dir: str) -> str:
+    """Create a fixture from a run journal; its response becomes the expected output."""
+    journal = TimelineJournal.load(journal_path)
+    if not journal:
+        raise FileNotFoundError(journal_path)
+
+    snapshot = journal.data.get("snapshot", {})
+    response = journal.data.get("response") or {}
+    fixture = {
+        "name": name,
+        "yesterday_entries": snapshot.get("yesterday", {}).get("entries", []),
+        "today_entries": snapshot.get("today", {}).get("entries", []),
+        "expected": {
+            day: [a["string"] for a in response.get(day, []) if "string" in a]
+            for day in ["yesterday", "today"]
+        },
+    }
+
+    os.makedirs(golden_dir, exist_ok=True)
+    path = os.path.join(golden_dir, f"{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(fixture, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    return path
+
+
+def record_fixture(fixture: dict, report: dict):
+    """Store a live run's raw response text and stats as the fixture's recording.
+
+    The text is kept exactly as the model returned it, so replays exercise
+    parsing, repair and local tagging the same way a live run does.
+    """
+    if not report.get("response_text"):
+        return
+    fixture["recorded"] = {
+        "response_text": report["response_text"],
+        **report.get("stats", {}),
+    }
+    path = fixture.pop("_path")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(fixture, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Evaluate timeline formatting against golden days")
+    parser.add_argument("--model", action="append", default=[],
+                        help="run live against this model (repeatable); default replays recordings offline")
+    parser.add_argument("--fixture", action="append", help="only run fixtures with this name (repeatable)")
+    parser.add_argument("--golden-dir", default=GOLDEN_DIR, help="fixture directory")
+    parser.add_argument("--tag-index", help="tag index to use for local tagging (default: none)")
+    parser.add_argument("--record", action="store_true", help="store live responses as fixture recordings")
+    parser.add_argument("--json", help="write full per-fixture reports to this file")
+    parser.add_argument("--from-journal", help="create a fixture from a run journal and exit")
+    parser.add_argument("--name", help="fixture name for --from-journal")
+    args = parser.parse_args()
+
+    if args.from_journal:
+        name = args.name or os.path.splitext(os.path.basename(args.from_journal))[0]
+        path = fixture_from_journal(args.from_journal, name, args.golden_dir)
+        print(f"Wrote {path} - review its \"expected\" timelines before relying on it")
+        return
+
+    if args.model and not os.environ.get("ANTHROPIC_API_KEY"):
+        print("Error: ANTHROPIC_API_KEY is required for live runs")
+        sys.exit(1)
+    if args.record and len(args.model) != 1:
+        print("Error: --record needs exactly one --model")
+        sys.exit(1)
+
+    fixtures = load_fixtures(args.golden_dir, args.fixture)
+    if not fixtures:
+        print(f"No fixtures found in {args.golden_dir}")
+        sys.exit(1)
+
+    tag_index = TagIndex.load(args.tag_index) if args.tag_index else None
+    configs = args.model or [None]
+
+    summaries = []
+    all_reports = {}
+    for model in configs:
+        label = model or "recorded"
+        reports = []
+        for fixture in fixtures:
+            print(f"\n=== {label} / {fixture['name']} ===")
+            try:
+                report = run_fixture(fixture, model, tag_index)
+            except Exception as e:
+                report = {"name": fixture["name"], "error": str(e)}
+            reports.append(report)
+            if args.record:
+                record_fixture(fixture, report)
+        all_reports[label] = reports
+        summaries.append(summarize(label, reports))
+
+    print()
+    print_summary(summaries)
+
+    synthetic = [f["name"] for f in fixtures if f.get("synthetic")]
+    if synthetic:
+        print(f"\n[WARN] Synthetic fixtures, not real days: {', '.join(synthetic)}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"summaries": summaries, "reports": all_reports}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,15 @@ entries in Roam Research using Claude AI.
 
 Usage:
     python format_timeline_agent.py
+    python format_timeline_agent.py --resume [--journal PATH]
+    python format_timeline_agent.py --restore-snapshot [--journal PATH]
+
+    Without --journal, --resume and --restore-snapshot use the most recent
+    journal with unfinished batches (or today's journal if there is none).
+    On GitHub Actions the journal directory is carried between runs by the
+    cache, so these can be run from the workflow's "mode" input. Failed runs
+    also upload it as the "timeline-journal" artifact; to recover locally,
+    download it and pass the file with --journal.
 
 Environment Variables Required:
     - ANTHROPIC_API_KEY: Anthropic API key
@@ -14,13 +23,22 @@ Environment Variables Required:
     - ANTHROPIC_MODEL: Model to use (optional, default: claude-sonnet-4-20250514)
     - ROAM_API_TOKEN: Roam Research API token
     - ROAM_GRAPH_NAME: Roam graph name
+    - TIMELINE_JOURNAL_DIR: Directory for write-ahead journals (optional)
+    - TIMELINE_TAG_INDEX: Path of the local tag index (optional)
+    - TAG_INDEX_DAYS: Days of history to backfill into the tag index (optional, default: 14)
 """
 
 import os
 import sys
 import json
+import argparse
+import copy
+import glob
 import re
+import math
+import time
 import requests
+from collections import Counter, defaultdict
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
@@ -43,6 +61,35 @@ PEERS = [
     "peer-23.api.roamresearch.com:3001",
 ]
 
+# Write-ahead journal location (one file per run date)
+JOURNAL_DIR = os.environ.get(
+    "TIMELINE_JOURNAL_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".timeline-journal"),
+)
+
+# Local tag index built from past formatted timelines
+TAG_INDEX_PATH = os.environ.get(
+    "TIMELINE_TAG_INDEX",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".timeline-tags.json"),
+)
+TAG_INDEX_DAYS = int(os.environ.get("TAG_INDEX_DAYS", 14))
+# A tag is applied locally only when the nearest neighbour is this similar...
+TAG_MIN_SIMILARITY = 0.6
+# ...and this share of the neighbours' weight agrees on it
+TAG_MIN_AGREEMENT = 0.8
+
+# "HH:MM - HH:MM (**duration**) - activity #[[Category]]"
+FORMATTED_ENTRY_RE = re.compile(
+    r"^\s*(\d{2}:\d{2})\s*-\s*(\d{2}:\d{2})\s*[(（]\*\*([^*]*)\*\*[)）]\s*-\s*(.*)$"
+)
+# Same, but the model left out the "(**duration**)" part
+UNTIMED_ENTRY_RE = re.compile(r"^\s*(\d{2}:\d{2})\s*-\s*(\d{2}:\d{2})\s*-\s*(.*)$")
+TAG_RE = re.compile(r"#\[\[[^\]]+\]\]")
+
+# Gaps/overlaps between consecutive entries up to this size are snapped shut;
+# larger ones are reported instead of guessed at
+REPAIR_MAX_SNAP_MINUTES = 30
+
 
 class RoamClient:
     """Client for interacting with Roam Research API."""
@@ -107,8 +154,8 @@ class RoamClient:
         """Execute a write action."""
         return self._make_request("write", {"action": action, **data}, use_peers=True)
 
-    def get_daily_page_uid(self, date: datetime) -> Optional[str]:
-        """Get the UID of a daily notes page."""
+    def get_daily_page_uid(self, date: datetime, strict: bool = False) -> Optional[str]:
+        """Get the UID of a daily notes page (query errors raise if strict)."""
         # Roam daily notes format: "January 17th, 2026"
         page_title = self._format_roam_date(date)
         query = f"""[:find ?uid :where [?p :node/title ?title] [?p :block/uid ?uid] [(= ?title "{page_title}")]]"""
@@ -120,6 +167,8 @@ class RoamClient:
                 print(f"  [DEBUG] Page not found: '{page_title}'")
         except Exception as e:
             print(f"  [DEBUG] Error finding page '{page_title}': {e}")
+            if strict:
+                raise
         return None
 
     def _format_roam_date(self, date: datetime) -> str:
@@ -128,8 +177,8 @@ class RoamClient:
         suffix = "th" if 4 <= day <= 20 or 24 <= day <= 30 else ["st", "nd", "rd"][day % 10 - 1]
         return f"{date.strftime('%B')} {day}{suffix}, {date.year}"
 
-    def find_timeline_block_uid(self, page_uid: str) -> Optional[str]:
-        """Find the Timeline block UID under a page."""
+    def find_timeline_block_uid(self, page_uid: str, strict: bool = False) -> Optional[str]:
+        """Find the Timeline block UID under a page (query errors raise if strict)."""
         query = f"""[:find ?uid ?str :where
           [?b :block/uid "{page_uid}"]
           [?b :block/children ?c]
@@ -141,11 +190,16 @@ class RoamClient:
             if result.get("result") and len(result["result"]) > 0:
                 return result["result"][0][0]
         except Exception:
-            pass
+            if strict:
+                raise
         return None
 
-    def get_timeline_entries(self, timeline_uid: str) -> list[dict]:
-        """Get all entries under the Timeline block."""
+    def get_timeline_entries(self, timeline_uid: str, strict: bool = False) -> list[dict]:
+        """Get all entries under the Timeline block.
+
+        Query failures return [] unless strict, in which case they raise so
+        callers can tell an empty timeline from a failed fetch.
+        """
         query = f"""[:find (pull ?child [:block/uid :block/string :block/order]) :where
           [?b :block/uid "{timeline_uid}"]
           [?b :block/children ?child]]"""
@@ -165,6 +219,8 @@ class RoamClient:
                 })
             return sorted(entries, key=lambda x: x.get("order", 0))
         except Exception:
+            if strict:
+                raise
             return []
 
     def delete_block(self, block_uid: str) -> bool:
@@ -250,12 +306,385 @@ def calculate_duration(start: str, end: str) -> int:
     return diff
 
 
+def get_last_end_time(entries: list[dict]) -> Optional[str]:
+    """End time of the last entry that has an "HH:MM - HH:MM" range."""
+    for entry in reversed(entries):
+        match = re.search(r"(\d{2}:\d{2})\s*-\s*(\d{2}:\d{2})", entry["content"])
+        if match:
+            return match[2]
+    return None
+
+
+def _minutes_between(earlier: str, later: str) -> int:
+    """Signed minutes from one HH:MM to another, taking the shorter way round midnight."""
+    diff = (parse_time_to_minutes(later) - parse_time_to_minutes(earlier)) % (24 * 60)
+    return diff - 24 * 60 if diff > 12 * 60 else diff
+
+
+def _parse_entry_times(string: str) -> Optional[tuple[str, str, str]]:
+    """(start, end, activity) of an entry, with or without its duration."""
+    match = FORMATTED_ENTRY_RE.match(string)
+    if match:
+        return match[1], match[2], match[4].strip()
+    match = UNTIMED_ENTRY_RE.match(string)
+    if match:
+        return match[1], match[2], match[3].strip()
+    return None
+
+
+def _entry_key(string: str) -> tuple:
+    """Identity of an entry regardless of how its duration was written."""
+    return _parse_entry_times(string) or (string.strip(),)
+
+
+def repair_day_entries(
+    entries: list[dict],
+    previous_end: Optional[str],
+    day_name: str
+) -> tuple[list[dict], list[str], list[str]]:
+    """Deterministically fix one day's model output.
+
+    Sorts by order, drops exact duplicates, snaps small gaps/overlaps so each
+    entry starts where the previous one ended, recomputes every duration from
+    its time range (adding it where missing) and renumbers orders from 0.
+    Returns the repaired entries, the fixes applied (before → after) and the
+    problems that could not be fixed safely.
+    """
+    fixes = []
+    issues = []
+    indexed = [(i, e) for i, e in enumerate(entries) if isinstance(e, dict) and "string" in e]
+    indexed.sort(key=lambda x: (x[1].get("order") if isinstance(x[1].get("order"), int) else x[0], x[0]))
+
+    repaired = []
+    seen = set()
+    for _, entry in indexed:
+        string = entry["string"].strip()
+        if _entry_key(string) in seen:
+            fixes.append(f"{day_name}: dropped duplicate entry: {string}")
+            continue
+        seen.add(_entry_key(string))
+
+        parsed = _parse_entry_times(string)
+        if not parsed:
+            issues.append(f"{day_name}: not in standard format, left as is: {string}")
+            repaired.append({**entry, "string": string})
+            # Continuity can't be checked across an entry we can't read
+            previous_end = None
+            continue
+
+        start, end, rest = parsed
+        if previous_end and start != previous_end:
+            shift = _minutes_between(previous_end, start)
+            length = calculate_duration(start, end)
+            if abs(shift) > REPAIR_MAX_SNAP_MINUTES:
+                kind = "gap" if shift > 0 else "overlap"
+                issues.append(f"{day_name}: {abs(shift)}' {kind} before '{string}' (previous end {previous_end})")
+            elif shift < 0 and -shift >= length:
+                issues.append(f"{day_name}: '{string}' lies inside the previous entry (ends {previous_end})")
+            else:
+                start = previous_end
+
+        fixed = f"{start} - {end} (**{format_duration(calculate_duration(start, end))}**) - {rest}"
+        if fixed != string:
+            fixes.append(f"{day_name}: '{string}' → '{fixed}'")
+        repaired.append({**entry, "string": fixed})
+        previous_end = end
+
+    original_orders = [e.get("order") for e in repaired]
+    for order, entry in enumerate(repaired):
+        entry["order"] = order
+    if original_orders != list(range(len(repaired))):
+        fixes.append(f"{day_name}: renumbered orders {original_orders} → 0..{len(repaired) - 1}")
+    return repaired, fixes, issues
+
+
+def repair_timeline(result: dict, yesterday_last_end: Optional[str]) -> tuple[list[str], list[str]]:
+    """Repair both days of a parsed model response in place.
+
+    Returns (fixes applied, issues that could not be fixed).
+    """
+    # Keys from the model's own yesterday entries too, so a copy leaked into
+    # today still matches after the repair snaps yesterday's version
+    yesterday_keys = {
+        _entry_key(e["string"]) for e in result.get("yesterday", [])
+        if isinstance(e, dict) and "string" in e
+    }
+    yesterday, fixes, issues = repair_day_entries(result.get("yesterday", []), None, "yesterday")
+
+    # Entries the model repeated in today's array belong to yesterday only
+    yesterday_keys |= {_entry_key(e["string"]) for e in yesterday}
+    today_input = []
+    for entry in result.get("today", []):
+        if isinstance(entry, dict) and _entry_key(entry.get("string", "")) in yesterday_keys:
+            fixes.append(f"today: dropped entry already in yesterday: {entry['string']}")
+        else:
+            today_input.append(entry)
+
+    # Today continues from wherever yesterday now ends
+    last_end = get_last_end_time([{"content": e["string"]} for e in yesterday]) or yesterday_last_end
+    today, day_fixes, day_issues = repair_day_entries(today_input, last_end, "today")
+    fixes += day_fixes
+    issues += day_issues
+
+    result["yesterday"] = yesterday
+    result["today"] = today
+    return fixes, issues
+
+
+def split_activity_and_tags(content: str) -> tuple[str, str]:
+    """Split an entry into its activity text and its tags ("#[[A]] #[[B]]")."""
+    match = FORMATTED_ENTRY_RE.match(content)
+    if match:
+        text = match[4]
+    else:
+        # Raw entry: drop leading time references like "9.15-10点半"
+        text = re.sub(r"^\s*\d[\d\s:.：点半~\-到]*", "", content)
+    tags = " ".join(TAG_RE.findall(text))
+    activity = TAG_RE.sub("", text).strip()
+    return activity, tags
+
+
+class TagIndex:
+    """Nearest-neighbour tagger over past (activity text -> tag) pairs.
+
+    Activities are embedded as L2-normalised character n-gram counts and
+    looked up through an inverted index, so short Chinese phrases like
+    "吃午饭" and "午饭" still land near each other. Only the raw pairs and
+    the set of indexed days are persisted; vectors are rebuilt on load and
+    new days are added incrementally.
+    """
+
+    NGRAM_SIZES = (1, 2, 3)
+    NEIGHBORS = 5
+
+    def __init__(self, path: str):
+        self.path = path
+        self.days: set[str] = set()
+        self.pairs: list[tuple[str, str]] = []
+        self._vectors: list[dict[str, float]] = []
+        self._postings: dict[str, list[int]] = defaultdict(list)
+
+    @classmethod
+    def load(cls, path: str = TAG_INDEX_PATH) -> "TagIndex":
+        """Load the index from disk, or return an empty one."""
+        index = cls(path)
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                index.days = set(data.get("days", []))
+                for text, label in data.get("pairs", []):
+                    index._add(text, label)
+            except Exception as e:
+                print(f"  [TAGS] Could not load tag index, starting empty: {e}")
+                index = cls(path)
+        return index
+
+    def save(self):
+        """Persist indexed days and pairs."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"days": sorted(self.days), "pairs": self.pairs},
+                f, ensure_ascii=False, indent=1,
+            )
+        os.replace(tmp_path, self.path)
+
+    @classmethod
+    def _vectorize(cls, text: str) -> dict[str, float]:
+        """Character n-gram vector of normalised activity text."""
+        text = re.sub(r"\s+", " ", text.lower()).strip()
+        counts = Counter(
+            text[i:i + n]
+            for n in cls.NGRAM_SIZES
+            for i in range(len(text) - n + 1)
+        )
+        norm = math.sqrt(sum(c * c for c in counts.values()))
+        return {gram: c / norm for gram, c in counts.items()} if norm else {}
+
+    def _add(self, text: str, label: str):
+        vector = self._vectorize(text)
+        if not vector:
+            return
+        index = len(self.pairs)
+        self.pairs.append((text, label))
+        self._vectors.append(vector)
+        for gram in vector:
+            self._postings[gram].append(index)
+
+    def add_day(self, day_key: str, contents: list[str]) -> int:
+        """Index the tagged entries of one formatted day; returns pairs added."""
+        if day_key in self.days:
+            return 0
+        added = 0
+        for content in contents:
+            activity, tags = split_activity_and_tags(content)
+            if activity and tags:
+                self._add(activity, tags)
+                added += 1
+        self.days.add(day_key)
+        return added
+
+    def neighbors(self, text: str) -> list[tuple[float, str]]:
+        """Most similar indexed activities as (cosine similarity, tag) pairs."""
+        vector = self._vectorize(text)
+        scores: dict[int, float] = defaultdict(float)
+        for gram, weight in vector.items():
+            for index in self._postings.get(gram, ()):
+                scores[index] += weight * self._vectors[index][gram]
+        best = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:self.NEIGHBORS]
+        return [(score, self.pairs[index][1]) for index, score in best]
+
+    def predict(self, text: str) -> tuple[Optional[str], list[str]]:
+        """Return (confident tag or None, ranked candidate tags)."""
+        neighbors = self.neighbors(text)
+        if not neighbors:
+            return None, []
+
+        votes: dict[str, float] = defaultdict(float)
+        for score, label in neighbors:
+            votes[label] += score
+        candidates = sorted(votes, key=votes.get, reverse=True)
+        agreement = votes[candidates[0]] / sum(votes.values())
+
+        if neighbors[0][0] >= TAG_MIN_SIMILARITY and agreement >= TAG_MIN_AGREEMENT:
+            return candidates[0], candidates[:3]
+        return None, candidates[:3]
+
+
+class TimelineJournal:
+    """Write-ahead journal for a single formatting run.
+
+    Everything needed to finish or undo a run is persisted before Roam is
+    touched: the fetched snapshot of both timelines, the parsed model output
+    and each planned write batch. Batches are marked done only after Roam
+    accepts them, so a failed run can be replayed without calling the model.
+    """
+
+    def __init__(self, path: str, data: Optional[dict] = None):
+        self.path = path
+        self.data = data or {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "snapshot": {},
+            "response": None,
+            "batches": [],
+        }
+
+    @classmethod
+    def for_date(cls, date: datetime, journal_dir: str = JOURNAL_DIR) -> "TimelineJournal":
+        """Return a fresh journal for the given run date."""
+        return cls(cls.path_for_date(date, journal_dir))
+
+    @staticmethod
+    def path_for_date(date: datetime, journal_dir: str = JOURNAL_DIR) -> str:
+        """Journal file path for a run date: <journal_dir>/YYYY-MM-DD.json."""
+        return os.path.join(journal_dir, f"{date.strftime('%Y-%m-%d')}.json")
+
+    @classmethod
+    def load(cls, path: str) -> Optional["TimelineJournal"]:
+        """Load an existing journal, or None if there is none at path."""
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(path, json.load(f))
+
+    @property
+    def batches(self) -> list[dict]:
+        return self.data["batches"]
+
+    def _flush(self):
+        """Atomically persist the journal to disk."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def record_snapshot(self, day: str, timeline_uid: Optional[str], entries: list[dict]):
+        """Record the timeline contents as fetched, before any write."""
+        self.data["snapshot"][day] = {
+            "timeline_uid": timeline_uid,
+            "entries": entries,
+        }
+        self._flush()
+
+    def record_response(
+        self,
+        result: dict,
+        raw_result: Optional[dict] = None,
+        repairs: Optional[dict] = None
+    ):
+        """Record the output to be written, the model output as parsed and the local repairs."""
+        self.data["response"] = result
+        if raw_result is not None:
+            self.data["raw_response"] = raw_result
+        if repairs is not None:
+            self.data["repairs"] = repairs
+        self._flush()
+
+    def plan_batch(self, day: str, kind: str, timeline_uid: str, actions: list[dict]) -> int:
+        """Record a batch before it is sent; returns its index."""
+        self.batches.append({
+            "day": day,
+            "kind": kind,
+            "timeline_uid": timeline_uid,
+            "actions": actions,
+            "done": False,
+        })
+        self._flush()
+        return len(self.batches) - 1
+
+    def mark_done(self, index: int):
+        """Mark a batch as accepted by Roam."""
+        self.batches[index]["done"] = True
+        self.batches[index]["completed_at"] = datetime.now().isoformat(timespec="seconds")
+        self._flush()
+
+    @classmethod
+    def find_unfinished(cls, journal_dir: str = JOURNAL_DIR) -> Optional["TimelineJournal"]:
+        """Most recent journal in journal_dir that still has pending batches."""
+        for path in sorted(glob.glob(os.path.join(journal_dir, "*.json")), reverse=True):
+            try:
+                journal = cls.load(path)
+            except Exception as e:
+                print(f"  [JOURNAL] Skipping unreadable journal {path}: {e}")
+                continue
+            if journal and journal.pending_batches():
+                return journal
+        return None
+
+    def pending_batches(self) -> list[int]:
+        """Indices of batches that have not completed yet, in plan order."""
+        return [i for i, b in enumerate(self.batches) if not b.get("done")]
+
+
 class TimelineFormatter:
     """Handles timeline formatting logic."""
 
-    def __init__(self, roam_client: RoamClient):
+    def __init__(
+        self,
+        roam_client: Optional[RoamClient],
+        anthropic_client=None,
+        model: Optional[str] = None
+    ):
         self.roam = roam_client
         self.skill_md = self._load_skill_guide()
+        self.tag_index: Optional[TagIndex] = None
+        # Confident tags promised to the model in the last prompt, by source uid
+        self.tag_hints: dict[str, str] = {}
+        # Injectable so the evaluation harness can replay recorded responses
+        self.anthropic = anthropic_client
+        self.model = model or os.environ.get("ANTHROPIC_MODEL", "claude-sonnet-4-20250514")
+        # Timing, token usage and raw text of the most recent model call
+        self.last_call_stats: dict = {}
+        self.last_response_text = ""
+        # Last response as parsed, and what the local repair pass did to it
+        self.last_parsed_response: Optional[dict] = None
+        self.last_repair_fixes: list[str] = []
+        self.last_repair_issues: list[str] = []
 
     def _load_skill_guide(self) -> str:
         """Load the format-daily-timeline skill guide."""
@@ -348,6 +777,72 @@ class TimelineFormatter:
             print(f"[DEBUG] Failed to parse truncated JSON: {e}")
         return None
 
+    def update_tag_index(self, today: datetime):
+        """Backfill finished days missing from the local tag index."""
+        self.tag_index = TagIndex.load()
+        added = 0
+        # Yesterday is still being formatted; it is indexed after this run writes it
+        for offset in range(2, TAG_INDEX_DAYS + 1):
+            day = today - timedelta(days=offset)
+            day_key = day.strftime("%Y-%m-%d")
+            if day_key in self.tag_index.days:
+                continue
+            # Days that are missing or fail to fetch stay unmarked and are retried next run
+            try:
+                page_uid = self.roam.get_daily_page_uid(day, strict=True)
+                timeline_uid = self.roam.find_timeline_block_uid(page_uid, strict=True) if page_uid else None
+                if not timeline_uid:
+                    continue
+                entries = self.roam.get_timeline_entries(timeline_uid, strict=True)
+            except Exception as e:
+                print(f"  [TAGS] Could not fetch {day_key}, will retry next run: {e}")
+                continue
+            added += self.tag_index.add_day(day_key, [e["content"] for e in entries])
+        print(f"[TAGS] Index: {len(self.tag_index.pairs)} pairs ({added} new)")
+        self.tag_index.save()
+
+    def _format_entry_line(self, entry: dict) -> str:
+        """Format an input entry for the prompt, with a local tag hint if any."""
+        line = f"- [{entry['uid']}] {entry['content']}"
+        if not self.tag_index:
+            return line
+        activity, tags = split_activity_and_tags(entry["content"])
+        if tags or not activity:
+            return line
+        tag, candidates = self.tag_index.predict(activity)
+        if tag:
+            self.tag_hints[entry["uid"]] = tag
+            return f"{line}  → tag: {tag}"
+        if candidates:
+            return f"{line}  → candidates: {', '.join(candidates)}"
+        return line
+
+    def _apply_local_tags(self, result: dict) -> int:
+        """Append local tags to output entries the model left untagged.
+
+        Entries that echo the uid of a "→ tag:" input get exactly the tag that
+        was promised in the prompt, since the model may have reworded them;
+        anything else falls back to a fresh prediction.
+        """
+        if not self.tag_index:
+            return 0
+        tagged = 0
+        for day in ["yesterday", "today"]:
+            for entry in result.get(day, []):
+                string = entry.get("string", "")
+                activity, tags = split_activity_and_tags(string)
+                if tags or not activity:
+                    continue
+                tag = self.tag_hints.get(entry.get("source", ""))
+                if not tag:
+                    tag, _ = self.tag_index.predict(activity)
+                if tag:
+                    entry["string"] = f"{string.rstrip()} {tag}"
+                    tagged += 1
+                else:
+                    print(f"  [TAGS] No confident tag for: {string}")
+        return tagged
+
     def get_prompt_for_both_days(
         self,
         yesterday_entries: list[dict],
@@ -357,15 +852,16 @@ class TimelineFormatter:
         yesterday_timeline_uid: Optional[str]
     ) -> str:
         """Generate the Claude prompt for formatting both yesterday and today timelines."""
+        self.tag_hints = {}
 
         # Format yesterday entries for the prompt
         yesterday_text = "\n".join([
-            f"- [{e['uid']}] {e['content']}" for e in yesterday_entries
+            self._format_entry_line(e) for e in yesterday_entries
         ]) if yesterday_entries else "(No yesterday entries)"
 
         # Format today entries for the prompt
         today_text = "\n".join([
-            f"- [{e['uid']}] {e['content']}" for e in today_entries
+            self._format_entry_line(e) for e in today_entries
         ]) if today_entries else "(No today entries)"
 
         prompt = f"""You are a specialized agent for formatting daily journal timeline entries in Roam Research.
@@ -424,11 +920,15 @@ HH:MM - HH:MM (**duration**) - activity description #[[Category]]
    - Use tags like: #[[吃饭]], #[[🎬Entertainment]], #[[睡觉]], #[[🚇Commuting]], #[[🧠Brain]], #[[wc]], #[[文档撰写]], #[[跑步]], #[[洗漱]], #[[Personal]], #[[P/...]]
    - Analyze activity description and match to best category
    - Put tags at the end: "HH:MM - HH:MM (**duration**) - activity #[[Category]]"
+   - Some input entries carry hints from past timelines:
+     - "→ tag: #[[X]]": if you keep the entry as ONE entry, OMIT its tag and add "source": "<its uid>" to the output entry - the tag is added automatically. If you split it, tag every part yourself
+     - "→ candidates: #[[X]], #[[Y]]": prefer one of these candidates
 
 ## Output Format
 
 Return JSON with exactly two keys: "yesterday" and "today"
 Each entry needs: "string" (the formatted timeline entry) and "order" (position 0, 1, 2...)
+Entries for a "→ tag:" input kept as one entry also carry "source" (the input uid) and no tag.
 
 ```json
 {{
@@ -438,24 +938,164 @@ Each entry needs: "string" (the formatted timeline entry) and "order" (position
     {{"string": "02:33 - 08:30 (**5h57'**) - activity description #[[Category]]", "order": 2}}
   ],
   "today": [
-    {{"string": "08:30 - 09:00 (**30'**) - activity description #[[Category]]", "order": 0}}
+    {{"string": "08:30 - 09:00 (**30'**) - activity description #[[Category]]", "order": 0}},
+    {{"string": "09:00 - 09:30 (**30'**) - activity description", "order": 1, "source": "input-uid"}}
   ]
 }}
 ```
 
 Important: Output ALL entries in strict chronological order!
 The order field indicates the position (0, 1, 2, 3...) in the timeline.
-EVERY entry must have a category tag at the end!
+EVERY entry must have a category tag at the end (except the "→ tag:" entries described above)!
 
 Output ONLY valid JSON starting with {{ and ending with }}}}."""
 
         return prompt
 
+    def _call_model(self, prompt: str) -> str:
+        """Send the prompt to Claude and return the response text.
+
+        Streams the response so time-to-first-token can be measured; timing
+        and token usage are left in self.last_call_stats.
+        """
+        if self.anthropic is None:
+            self.anthropic = Anthropic(
+                api_key=os.environ.get("ANTHROPIC_API_KEY"),
+                base_url=os.environ.get("ANTHROPIC_BASE_URL") or None,
+            )
+
+        print(f"Using model: {self.model}")
+
+        started = time.perf_counter()
+        first_token_at = None
+        # Force JSON output without thinking - use higher max_tokens for long responses
+        with self.anthropic.messages.stream(
+            model=self.model,
+            max_tokens=16384,
+            system="You are a JSON-only response agent. Always output valid JSON in the exact format requested. Do not include any explanation, thinking, or markdown formatting outside the JSON. Start your response directly with { and end with }.",
+            messages=[{"role": "user", "content": prompt}],
+        ) as stream:
+            for event in stream:
+                if first_token_at is None and getattr(event, "type", "") == "content_block_delta":
+                    first_token_at = time.perf_counter()
+            response = stream.get_final_message()
+        finished = time.perf_counter()
+
+        usage = getattr(response, "usage", None)
+        self.last_call_stats = {
+            "model": self.model,
+            "ttft": (first_token_at - started) if first_token_at else None,
+            "latency": finished - started,
+            "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+            "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+            "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+            "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+        }
+
+        print(f"[DEBUG] Response type: {type(response)}")
+        print(f"[DEBUG] Response id: {getattr(response, 'id', 'N/A')}")
+        print(f"[DEBUG] Response content length: {len(response.content) if hasattr(response, 'content') else 0}")
+        print(f"[DEBUG] Call stats: {self.last_call_stats}")
+
+        # Extract response text from content blocks
+        response_text = ""
+        thinking_text = ""
+
+        if hasattr(response, 'content'):
+            for i, block in enumerate(response.content):
+                block_type = type(block).__name__
+                print(f"[DEBUG] Block {i}: {block_type}")
+
+                if hasattr(block, 'type') and block.type == 'text':
+                    # Text block
+                    response_text = getattr(block, 'text', '') or ''
+                    print(f"[DEBUG] Found text block: {response_text[:200] if response_text else 'EMPTY'}...")
+                elif hasattr(block, 'thinking'):
+                    # Thinking block - extract thinking content
+                    thinking_str = block.thinking if isinstance(block.thinking, str) else str(block.thinking)
+                    thinking_text += thinking_str
+                    print(f"[DEBUG] Found thinking block: {thinking_str[:200]}...")
+
+        # If no text block, use thinking content as response
+        if not response_text and thinking_text:
+            print(f"[DEBUG] Using thinking content as response")
+            response_text = thinking_text
+
+        if not response_text:
+            print("[ERROR] No text content in response")
+            print(f"[DEBUG] Full response: {response}")
+
+        self.last_response_text = response_text
+        return response_text
+
+    def generate_timeline(
+        self,
+        yesterday_entries: list[dict],
+        yesterday_last_end: Optional[str],
+        today_entries: list[dict],
+        today_timeline_uid: str,
+        yesterday_timeline_uid: Optional[str],
+        repair: bool = True
+    ) -> Optional[dict]:
+        """Ask Claude for the rebuilt timelines and parse them into {"yesterday": [...], "today": [...]}.
+
+        With repair=False the local repair pass is skipped, so the result is
+        what the model produced (plus local tags); the evaluation harness uses
+        this to score the model rather than the repair.
+        """
+        # Generate prompt for both days
+        prompt = self.get_prompt_for_both_days(
+            yesterday_entries,
+            yesterday_last_end,
+            today_entries,
+            today_timeline_uid,
+            yesterday_timeline_uid
+        )
+
+        self.last_parsed_response = None
+        self.last_repair_fixes = []
+        self.last_repair_issues = []
+        self.last_response_text = ""
+        response_text = self._call_model(prompt)
+        if not response_text:
+            return None
+
+        print(f"\nClaude response:\n{response_text[:500]}...")
+
+        # Parse JSON from response - use robust parsing for long responses
+        result = self._parse_json_response(response_text)
+        if not result:
+            print("[ERROR] Could not parse actions from response")
+            return None
+
+        # Fix small, mechanical mistakes locally instead of re-asking the model
+        self.last_parsed_response = copy.deepcopy(result)
+        if repair:
+            self.last_repair_fixes, self.last_repair_issues = repair_timeline(result, yesterday_last_end)
+            for fix in self.last_repair_fixes:
+                print(f"[REPAIR] Fixed {fix}")
+            for issue in self.last_repair_issues:
+                print(f"[REPAIR] Could not fix {issue}")
+
+        tagged = self._apply_local_tags(result)
+        if tagged:
+            print(f"[TAGS] Tagged {tagged} entries locally")
+        return result
+
     def format_today(self) -> bool:
         """Format today's timeline entries."""
         today = get_today_date()
         yesterday = get_yesterday_date()
 
+        # Refuse to start over on top of a half-applied run (from any date):
+        # the timeline may already be missing entries only the journal has.
+        previous = TimelineJournal.find_unfinished()
+        if previous:
+            print(f"[ERROR] Unfinished run found in journal: {previous.path}")
+            print("Re-run with --resume to finish it, or --restore-snapshot to roll it back")
+            return False
+        journal = TimelineJournal.for_date(today)
+
         # Get today's page UID
         today_uid = self.roam.get_daily_page_uid(today)
         if not today_uid:
@@ -475,6 +1115,7 @@ Output ONLY valid JSON starting with {{ and ending with }}}}."""
         # Get yesterday's last entry end time AND yesterday entries to format
         yesterday_uid = self.roam.get_daily_page_uid(yesterday)
         yesterday_last_end = None
+        yesterday_timeline_uid = None
         yesterday_entries = []  # Initialize to avoid UnboundLocalError
         yesterday_entries_to_format = []
 
@@ -491,13 +1132,9 @@ Output ONLY valid JSON starting with {{ and ending with }}}}."""
                     print("[DEBUG] Yesterday entries:")
                     for i, entry in enumerate(yesterday_entries):
                         print(f"  [{i}] UID={entry['uid']}: {entry['content'][:80]}...")
-                    # Find last entry with standard format
-                    for entry in reversed(yesterday_entries):
-                        match = re.search(r"(\d{2}:\d{2})\s*-\s*(\d{2}:\d{2})", entry["content"])
-                        if match:
-                            yesterday_last_end = match[2]
-                            print(f"[DEBUG] Found last end time: {yesterday_last_end}")
-                            break
+                    yesterday_last_end = get_last_end_time(yesterday_entries)
+                    if yesterday_last_end:
+                        print(f"[DEBUG] Found last end time: {yesterday_last_end}")
                     # Collect entries that need formatting
                     # Check for both English () and Chinese （） brackets
                     # Match patterns like: (**56'**) or （**56'**）
@@ -533,74 +1170,34 @@ Output ONLY valid JSON starting with {{ and ending with }}}}."""
         today_entries_to_format = today_entries
         print(f"[DEBUG] Today entries to process (all): {len(today_entries_to_format)}")
 
-        # Generate prompt for both days
-        prompt = self.get_prompt_for_both_days(
-            yesterday_entries,
-            yesterday_last_end,
-            today_entries,
-            timeline_uid,
-            yesterday_timeline_uid
-        )
-
-        # Call Claude
-        anthropic_client = Anthropic(
-            api_key=os.environ.get("ANTHROPIC_API_KEY"),
-            base_url=os.environ.get("ANTHROPIC_BASE_URL") or None,
-        )
+        journal.record_snapshot("yesterday", yesterday_timeline_uid, yesterday_entries)
+        journal.record_snapshot("today", timeline_uid, today_entries)
+        print(f"[JOURNAL] Snapshot saved to {journal.path}")
 
-        model = os.environ.get("ANTHROPIC_MODEL", "claude-sonnet-4-20250514")
-        print(f"Using model: {model}")
+        # A stale or unreachable tag index only costs hints, never the run
+        try:
+            self.update_tag_index(today)
+        except Exception as e:
+            print(f"[TAGS] Tag index unavailable: {e}")
+            self.tag_index = None
 
         try:
-            # Force JSON output without thinking - use higher max_tokens for long responses
-            response = anthropic_client.messages.create(
-                model=model,
-                max_tokens=16384,
-                system="You are a JSON-only response agent. Always output valid JSON in the exact format requested. Do not include any explanation, thinking, or markdown formatting outside the JSON. Start your response directly with { and end with }.",
-                messages=[{"role": "user", "content": prompt}],
+            result = self.generate_timeline(
+                yesterday_entries,
+                yesterday_last_end,
+                today_entries,
+                timeline_uid,
+                yesterday_timeline_uid
             )
-
-            print(f"[DEBUG] Response type: {type(response)}")
-            print(f"[DEBUG] Response id: {getattr(response, 'id', 'N/A')}")
-            print(f"[DEBUG] Response content length: {len(response.content) if hasattr(response, 'content') else 0}")
-
-            # Extract response text from content blocks
-            response_text = ""
-            thinking_text = ""
-
-            if hasattr(response, 'content'):
-                for i, block in enumerate(response.content):
-                    block_type = type(block).__name__
-                    print(f"[DEBUG] Block {i}: {block_type}")
-
-                    if hasattr(block, 'type') and block.type == 'text':
-                        # Text block
-                        response_text = getattr(block, 'text', '') or ''
-                        print(f"[DEBUG] Found text block: {response_text[:200] if response_text else 'EMPTY'}...")
-                    elif hasattr(block, 'thinking'):
-                        # Thinking block - extract thinking content
-                        thinking_str = block.thinking if isinstance(block.thinking, str) else str(block.thinking)
-                        thinking_text += thinking_str
-                        print(f"[DEBUG] Found thinking block: {thinking_str[:200]}...")
-
-            # If no text block, use thinking content as response
-            if not response_text and thinking_text:
-                print(f"[DEBUG] Using thinking content as response")
-                response_text = thinking_text
-
-            if not response_text:
-                print("[ERROR] No text content in response")
-                print(f"[DEBUG] Full response: {response}")
-                return False
-
-            print(f"\nClaude response:\n{response_text[:500]}...")
-
-            # Parse JSON from response - use robust parsing for long responses
-            result = self._parse_json_response(response_text)
             if not result:
-                print("[ERROR] Could not parse actions from response")
                 return False
 
+            journal.record_response(
+                result,
+                raw_result=self.last_parsed_response,
+                repairs={"fixes": self.last_repair_fixes, "issues": self.last_repair_issues},
+            )
+
             # Process both yesterday and today's actions
             all_actions = []
             for day in ["yesterday", "today"]:
@@ -614,7 +1211,20 @@ Output ONLY valid JSON starting with {{ and ending with }}}}."""
 
             # Execute batch actions for both days
             if all_actions:
-                self._execute_batch_actions(all_actions, timeline_uid, yesterday_timeline_uid)
+                if not self._execute_batch_actions(
+                    all_actions, timeline_uid, yesterday_timeline_uid, journal
+                ):
+                    if journal.pending_batches():
+                        print(f"[ERROR] Some writes failed; finish with --resume (journal: {journal.path})")
+                    return False
+
+            # Yesterday is final now; learn from it for future runs
+            if self.tag_index and result.get("yesterday"):
+                self.tag_index.add_day(
+                    yesterday.strftime("%Y-%m-%d"),
+                    [a["string"] for a in result.get("yesterday", []) if "string" in a],
+                )
+                self.tag_index.save()
 
             print("Done!")
             return True
@@ -627,32 +1237,57 @@ Output ONLY valid JSON starting with {{ and ending with }}}}."""
         self,
         all_actions: list[dict],
         today_timeline_uid: str,
-        yesterday_timeline_uid: Optional[str]
-    ):
-        """Execute batch actions for both days."""
+        yesterday_timeline_uid: Optional[str],
+        journal: TimelineJournal
+    ) -> bool:
+        """Plan batch actions for both days in the journal, then execute them."""
         print(f"\nExecuting {len(all_actions)} actions via batch...")
 
         # Group by day
         yesterday_actions = [a for a in all_actions if a.get("day") == "yesterday"]
         today_actions = [a for a in all_actions if a.get("day") == "today"]
 
-        # Execute yesterday actions
+        # Fetch the blocks to delete strictly: planning creates without the
+        # matching deletes would leave old and new entries side by side
+        existing = {}
+        try:
+            for actions, timeline_uid in [
+                (yesterday_actions, yesterday_timeline_uid),
+                (today_actions, today_timeline_uid),
+            ]:
+                if actions and timeline_uid:
+                    existing[timeline_uid] = self.roam.get_timeline_entries(timeline_uid, strict=True)
+        except Exception as e:
+            print(f"  [ERROR] Could not fetch existing entries, nothing was written: {e}")
+            return False
+
+        # Plan every batch before sending any, so a failure in one day
+        # still leaves the other day's writes recoverable from the journal
         if yesterday_actions:
             print(f"  Processing {len(yesterday_actions)} yesterday actions...")
-            self._execute_day_actions(yesterday_actions, yesterday_timeline_uid, "yesterday")
+            self._plan_day_actions(
+                yesterday_actions, yesterday_timeline_uid, "yesterday", journal,
+                existing.get(yesterday_timeline_uid, [])
+            )
 
-        # Execute today actions
         if today_actions:
             print(f"  Processing {len(today_actions)} today actions...")
-            self._execute_day_actions(today_actions, today_timeline_uid, "today")
+            self._plan_day_actions(
+                today_actions, today_timeline_uid, "today", journal,
+                existing.get(today_timeline_uid, [])
+            )
 
-    def _execute_day_actions(
+        return self._run_pending_batches(journal)
+
+    def _plan_day_actions(
         self,
         actions: list[dict],
         timeline_uid: Optional[str],
-        day_name: str
+        day_name: str,
+        journal: TimelineJournal,
+        existing_entries: list[dict]
     ):
-        """Rebuild timeline for a single day: delete all old, create all new in correct order."""
+        """Plan the rebuild of a single day: delete all old, create all new in correct order."""
         if not timeline_uid:
             print(f"  [WARN] No timeline UID for {day_name}, skipping")
             return
@@ -679,24 +1314,15 @@ Output ONLY valid JSON starting with {{ and ending with }}}}."""
         print(f"  [DEBUG] {day_name.capitalize()} entries to create: {len(entries)}")
 
         # Step 1: Delete all existing entries (we'll rebuild the timeline)
-        # Get all entries from the timeline to find UIDs to delete
-        existing_entries = self.roam.get_timeline_entries(timeline_uid)
-        if existing_entries:
-            delete_uids = [e["uid"] for e in existing_entries]
-            if delete_uids:
-                print(f"    Deleting {len(delete_uids)} existing {day_name} entries...")
-                roam_deletes = [
-                    {"action": "delete-block", "block": {"uid": uid}}
-                    for uid in delete_uids
-                ]
-                try:
-                    self.roam.write("batch-actions", actions=roam_deletes)
-                    print(f"    [OK] Deleted {len(delete_uids)} {day_name} entries")
-                except Exception as e:
-                    print(f"    [ERROR] Delete failed: {e}")
+        delete_uids = [e["uid"] for e in existing_entries]
+        if delete_uids:
+            roam_deletes = [
+                {"action": "delete-block", "block": {"uid": uid}}
+                for uid in delete_uids
+            ]
+            journal.plan_batch(day_name, "delete", timeline_uid, roam_deletes)
 
         # Step 2: Create all new entries in correct order
-        print(f"    Creating {len(entries)} new {day_name} entries in order...")
         roam_creates = []
         for entry in entries:
             order = entry.get("order", "last")
@@ -705,16 +1331,111 @@ Output ONLY valid JSON starting with {{ and ending with }}}}."""
                 "location": {"parent-uid": timeline_uid, "order": order},
                 "block": {"string": entry["string"]}
             })
+        journal.plan_batch(day_name, "create", timeline_uid, roam_creates)
+
+    def _run_pending_batches(self, journal: TimelineJournal, resume: bool = False) -> bool:
+        """Send every unfinished journal batch to Roam, stopping at the first failure."""
+        for index in journal.pending_batches():
+            batch = journal.batches[index]
+            day_name = batch["day"]
+            actions = batch["actions"]
+
+            if resume:
+                # An earlier attempt may have been applied without us seeing the
+                # response; only send what the timeline is still missing.
+                try:
+                    current = self.roam.get_timeline_entries(batch["timeline_uid"], strict=True)
+                except Exception as e:
+                    print(f"    [ERROR] Could not fetch {day_name} timeline: {e}")
+                    return False
+                if batch["kind"] == "delete":
+                    current_uids = {e["uid"] for e in current}
+                    actions = [a for a in actions if a["block"]["uid"] in current_uids]
+                else:
+                    current_strings = {e["content"] for e in current}
+                    actions = [a for a in actions if a["block"]["string"] not in current_strings]
 
-        try:
-            self.roam.write("batch-actions", actions=roam_creates)
-            print(f"    [OK] Created {len(entries)} {day_name} entries")
-        except Exception as e:
-            print(f"    [ERROR] Create failed: {e}")
+            if actions:
+                verb = "Deleting" if batch["kind"] == "delete" else "Creating"
+                print(f"    {verb} {len(actions)} {day_name} entries...")
+                try:
+                    self.roam.write("batch-actions", actions=actions)
+                except Exception as e:
+                    print(f"    [ERROR] {batch['kind'].capitalize()} failed: {e}")
+                    return False
+                print(f"    [OK] {batch['kind'].capitalize()} batch for {day_name} applied")
+            else:
+                print(f"    [OK] {batch['kind'].capitalize()} batch for {day_name} already applied")
+
+            journal.mark_done(index)
+        return True
+
+    def resume(self, journal: TimelineJournal) -> bool:
+        """Replay the unfinished batches of a previous run."""
+        pending = journal.pending_batches()
+        if not pending:
+            print(f"Nothing to resume in {journal.path}")
+            return True
+
+        print(f"Resuming {len(pending)} unfinished batches from {journal.path}")
+        return self._run_pending_batches(journal, resume=True)
+
+    def restore_snapshot(self, journal: TimelineJournal) -> bool:
+        """Rebuild both timelines exactly as they were fetched before the run."""
+        snapshot = journal.data.get("snapshot", {})
+        if not snapshot:
+            print(f"[ERROR] No snapshot recorded in {journal.path}")
+            return False
+
+        success = True
+        for day_name, day in snapshot.items():
+            timeline_uid = day.get("timeline_uid")
+            if not timeline_uid:
+                continue
+
+            try:
+                current = self.roam.get_timeline_entries(timeline_uid, strict=True)
+            except Exception as e:
+                print(f"    [ERROR] Could not fetch {day_name} timeline: {e}")
+                success = False
+                continue
+            roam_actions = [
+                {"action": "delete-block", "block": {"uid": e["uid"]}}
+                for e in current
+            ]
+            for i, entry in enumerate(day.get("entries", [])):
+                roam_actions.append({
+                    "action": "create-block",
+                    "location": {"parent-uid": timeline_uid, "order": i},
+                    "block": {"string": entry["content"]}
+                })
+
+            print(f"  Restoring {len(day.get('entries', []))} {day_name} entries...")
+            try:
+                self.roam.write("batch-actions", actions=roam_actions)
+                print(f"    [OK] Restored {day_name}")
+            except Exception as e:
+                print(f"    [ERROR] Restore failed for {day_name}: {e}")
+                success = False
+
+        if success:
+            # The journal's plan no longer applies to the restored timelines
+            for index in journal.pending_batches():
+                journal.mark_done(index)
+        return success
 
 
 def main():
     """Main entry point."""
+    parser = argparse.ArgumentParser(description="Format daily timeline entries in Roam Research")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--resume", action="store_true",
+                      help="replay unfinished writes from the journal without calling the model")
+    mode.add_argument("--restore-snapshot", action="store_true",
+                      help="restore both timelines to the snapshot recorded in the journal")
+    parser.add_argument("--journal", help="journal file to use (default: today's journal)")
+    args = parser.parse_args()
+
     print("=" * 50)
     print("Format Daily Timeline Agent")
     print("=" * 50)
@@ -722,7 +1443,9 @@ def main():
     print()
 
     # Check required environment variables
-    required_vars = ["ANTHROPIC_API_KEY", "ROAM_API_TOKEN", "ROAM_GRAPH_NAME"]
+    required_vars = ["ROAM_API_TOKEN", "ROAM_GRAPH_NAME"]
+    if not (args.resume or args.restore_snapshot):
+        required_vars.insert(0, "ANTHROPIC_API_KEY")
     missing = [v for v in required_vars if not os.environ.get(v)]
     if missing:
         print(f"Error: Missing required environment variables: {', '.join(missing)}")
@@ -733,9 +1456,25 @@ def main():
     api_token = os.environ["ROAM_API_TOKEN"]
     roam = RoamClient(graph_name, api_token)
 
-    # Format timeline
     formatter = TimelineFormatter(roam)
-    success = formatter.format_today()
+
+    if args.resume or args.restore_snapshot:
+        if args.journal:
+            journal_path = args.journal
+            journal = TimelineJournal.load(journal_path)
+        else:
+            journal_path = TimelineJournal.path_for_date(get_today_date())
+            journal = TimelineJournal.find_unfinished() or TimelineJournal.load(journal_path)
+        if not journal:
+            print(f"Error: No journal found at {journal_path}")
+            sys.exit(1)
+        if args.resume:
+            success = formatter.resume(journal)
+        else:
+            success = formatter.restore_snapshot(journal)
+    else:
+        # Format timeline
+        success = formatter.format_today()
 
     if success:
         print("\nTimeline formatted successfully!")
@@ -0,0 +1,98 @@
+"""Tests for the golden-day evaluation metrics."""
+
+import pytest
+
+from eval_timeline import score_day, summarize
+
+
+EXPECTED = [
+    "12:23 - 13:10 (**47'**) - 刷抖音 #[[🎬Entertainment]]",
+    "13:10 - 13:36 (**26'**) - 午睡 #[[睡觉]]",
+    "13:36 - 14:00 (**24'**) - 玩 #[[🎬Entertainment]]",
+]
+
+
+def test_score_day_perfect_output():
+    scores = score_day(EXPECTED, EXPECTED)
+    assert scores == {
+        "matched": 3,
+        "output": 3,
+        "unparsed": 0,
+        "expected": 3,
+        "durations_ok": 3,
+        "tags_ok": 3,
+    }
+
+
+def test_score_day_missed_split():
+    output = [
+        "12:23 - 13:36 (**1h13'**) - 刷抖音 午睡 #[[🎬Entertainment]]",
+        "13:36 - 14:00 (**24'**) - 玩 #[[🎬Entertainment]]",
+    ]
+    scores = score_day(output, EXPECTED)
+    assert scores["matched"] == 1
+    assert scores["output"] == 2
+    assert scores["expected"] == 3
+
+
+def test_score_day_wrong_duration_and_tag():
+    output = [
+        "12:23 - 13:10 (**50'**) - 刷抖音 #[[🎬Entertainment]]",
+        "13:10 - 13:36 (**26'**) - 午睡 #[[Personal]]",
+        "13:36 - 14:00 (**24'**) - 玩",
+    ]
+    scores = score_day(output, EXPECTED)
+    assert scores["matched"] == 3
+    assert scores["durations_ok"] == 2
+    assert scores["tags_ok"] == 1
+
+
+def test_score_day_unparsed_lines():
+    output = EXPECTED[:2] + ["13:36 到 14 点 玩"]
+    scores = score_day(output, EXPECTED)
+    assert scores["unparsed"] == 1
+    assert scores["output"] == 3
+    assert scores["matched"] == 2
+    # Unparsed lines count against duration correctness
+    assert scores["durations_ok"] == 2
+
+
+def test_summarize_imperfect_reports():
+    reports = [
+        {
+            "name": "a",
+            "stats": {"ttft": 1.0, "latency": 4.0, "input_tokens": 100, "output_tokens": 40},
+            "scores": {
+                "yesterday": score_day(EXPECTED, EXPECTED),
+                "today": score_day(
+                    ["12:23 - 13:36 (**1h10'**) - 刷抖音 午睡 #[[🎬Entertainment]]", "garbage"],
+                    EXPECTED,
+                ),
+            },
+        },
+        {"name": "b", "stats": {"ttft": None, "latency": 6.0}, "error": "unparseable response"},
+    ]
+    reports[0]["repair_fixes"] = ["today: duration fixed", "today: renumbered orders"]
+    reports[0]["repair_issues"] = ["today: not in standard format, left as is: garbage"]
+    summary = summarize("m", reports)
+
+    assert summary["fixtures"] == 2
+    assert summary["errors"] == 1
+    assert summary["ttft"] == pytest.approx(1.0)
+    assert summary["latency"] == pytest.approx(5.0)
+    assert summary["input_tokens"] == 100
+    assert summary["output_tokens"] == 40
+    # 3 of 5 output lines match 3 of 6 expected spans
+    precision, recall = 3 / 5, 3 / 6
+    assert summary["split_f1"] == pytest.approx(2 * precision * recall / (precision + recall))
+    assert summary["duration_ok"] == pytest.approx(3 / 5)
+    assert summary["tag_agreement"] == pytest.approx(1.0)
+    assert summary["repairs"] == 2
+    assert summary["unfixable"] == 1
+
+
+def test_summarize_without_scores():
+    summary = summarize("m", [{"name": "a", "error": "no recorded response"}])
+    assert summary["errors"] == 1
+    assert summary["ttft"] is None
+    assert summary["split_f1"] == 0.0
@@ -0,0 +1,405 @@
+"""Tests for the local stages of format_timeline_agent."""
+
+from datetime import datetime
+
+import pytest
+
+from format_timeline_agent import (
+    TagIndex,
+    TimelineFormatter,
+    TimelineJournal,
+    repair_day_entries,
+    repair_timeline,
+    split_activity_and_tags,
+)
+
+
+def _strings(entries):
+    return [e["string"] for e in entries]
+
+
+# -- repair ---------------------------------------------------------------
+
+def test_repair_recomputes_wrong_duration():
+    entries, fixes, issues = repair_day_entries(
+        [{"string": "12:00 - 12:30 (**20'**) - 吃午饭 #[[吃饭]]", "order": 0}], None, "today"
+    )
+    assert _strings(entries) == ["12:00 - 12:30 (**30'**) - 吃午饭 #[[吃饭]]"]
+    assert fixes == ["today: '12:00 - 12:30 (**20'**) - 吃午饭 #[[吃饭]]' → '12:00 - 12:30 (**30'**) - 吃午饭 #[[吃饭]]'"]
+    assert issues == []
+
+
+def test_repair_adds_missing_duration():
+    entries, fixes, issues = repair_day_entries(
+        [
+            {"string": "12:00 - 13:15 - 写周报", "order": 0},
+            {"string": "13:15 - 13:40 (**25'**) - 午睡", "order": 1},
+        ],
+        None, "today"
+    )
+    assert _strings(entries) == [
+        "12:00 - 13:15 (**1h15'**) - 写周报",
+        "13:15 - 13:40 (**25'**) - 午睡",
+    ]
+    assert len(fixes) == 1
+    assert issues == []
+
+
+def test_repair_snaps_small_gap_and_overlap():
+    entries, _, issues = repair_day_entries(
+        [
+            {"string": "08:00 - 09:00 (**1h00'**) - a", "order": 0},
+            {"string": "09:10 - 10:00 (**50'**) - b", "order": 1},
+            {"string": "09:50 - 11:00 (**1h10'**) - c", "order": 2},
+        ],
+        None, "today"
+    )
+    assert _strings(entries) == [
+        "08:00 - 09:00 (**1h00'**) - a",
+        "09:00 - 10:00 (**1h00'**) - b",
+        "10:00 - 11:00 (**1h00'**) - c",
+    ]
+    assert issues == []
+
+
+def test_repair_snaps_across_midnight():
+    entries, _, issues = repair_day_entries(
+        [{"string": "00:05 - 01:00 (**55'**) - 睡前刷手机", "order": 0}], "23:50", "today"
+    )
+    assert _strings(entries) == ["23:50 - 01:00 (**1h10'**) - 睡前刷手机"]
+    assert issues == []
+
+
+def test_repair_today_continues_from_yesterday_last_end():
+    result = {"yesterday": [], "today": [{"string": "08:40 - 09:00 (**20'**) - 吃早饭", "order": 0}]}
+    fixes, issues = repair_timeline(result, "08:30")
+    assert _strings(result["today"]) == ["08:30 - 09:00 (**30'**) - 吃早饭"]
+    assert issues == []
+
+
+def test_repair_today_continues_from_repaired_yesterday():
+    result = {
+        "yesterday": [{"string": "02:30 - 08:30 (**6h00'**) - 睡觉", "order": 0}],
+        "today": [{"string": "08:20 - 09:00 (**40'**) - 吃早饭", "order": 0}],
+    }
+    repair_timeline(result, "02:00")
+    assert _strings(result["today"]) == ["08:30 - 09:00 (**30'**) - 吃早饭"]
+
+
+def test_repair_reports_large_gap_instead_of_snapping():
+    entries, _, issues = repair_day_entries(
+        [
+            {"string": "08:00 - 09:00 (**1h00'**) - a", "order": 0},
+            {"string": "09:45 - 10:00 (**15'**) - b", "order": 1},
+        ],
+        None, "today"
+    )
+    assert _strings(entries)[1] == "09:45 - 10:00 (**15'**) - b"
+    assert len(issues) == 1
+    assert "45' gap" in issues[0]
+
+
+def test_repair_reports_entry_inside_previous():
+    entries, _, issues = repair_day_entries(
+        [
+            {"string": "08:00 - 09:00 (**1h00'**) - a", "order": 0},
+            {"string": "08:40 - 08:50 (**10'**) - b", "order": 1},
+        ],
+        None, "today"
+    )
+    assert _strings(entries)[1] == "08:40 - 08:50 (**10'**) - b"
+    assert "inside the previous entry" in issues[0]
+
+
+def test_repair_unparseable_entry_left_as_is():
+    entries, _, issues = repair_day_entries(
+        [
+            {"string": "08:00 - 09:00 (**1h00'**) - a", "order": 0},
+            {"string": "然后去开会", "order": 1},
+            {"string": "11:00 - 12:00 (**1h00'**) - b", "order": 2},
+        ],
+        None, "today"
+    )
+    assert _strings(entries)[1:] == ["然后去开会", "11:00 - 12:00 (**1h00'**) - b"]
+    # Continuity is not checked across the unreadable entry
+    assert issues == ["today: not in standard format, left as is: 然后去开会"]
+
+
+def test_repair_drops_duplicates_in_a_day():
+    entries, fixes, _ = repair_day_entries(
+        [
+            {"string": "08:00 - 09:00 (**1h00'**) - a", "order": 0},
+            {"string": "08:00 - 09:00 (**60'**) - a", "order": 1},
+        ],
+        None, "today"
+    )
+    assert _strings(entries) == ["08:00 - 09:00 (**1h00'**) - a"]
+    assert any("dropped duplicate" in f for f in fixes)
+
+
+def test_repair_drops_yesterday_entry_leaked_into_today():
+    result = {
+        "yesterday": [{"string": "02:30 - 08:30 (**6h00'**) - 睡觉", "order": 0}],
+        "today": [
+            {"string": "02:30 - 08:30 (**6h**) - 睡觉", "order": 0},
+            {"string": "08:30 - 09:00 (**30'**) - 吃早饭", "order": 1},
+        ],
+    }
+    fixes, issues = repair_timeline(result, None)
+    assert _strings(result["today"]) == ["08:30 - 09:00 (**30'**) - 吃早饭"]
+    assert any("already in yesterday" in f for f in fixes)
+    assert issues == []
+
+
+def test_repair_drops_leaked_copy_of_snapped_yesterday_entry():
+    result = {
+        "yesterday": [
+            {"string": "00:00 - 01:37 (**1h37'**) - a", "order": 0},
+            {"string": "01:40 - 02:30 (**50'**) - b", "order": 1},
+        ],
+        "today": [{"string": "01:40 - 02:30 (**50'**) - b", "order": 0}],
+    }
+    fixes, issues = repair_timeline(result, None)
+    assert _strings(result["yesterday"])[1] == "01:37 - 02:30 (**53'**) - b"
+    assert result["today"] == []
+    assert issues == []
+
+
+def test_repair_sorts_and_renumbers_orders():
+    entries, fixes, _ = repair_day_entries(
+        [
+            {"string": "10:00 - 11:00 (**1h00'**) - c", "order": 5},
+            {"string": "08:00 - 09:00 (**1h00'**) - a", "order": 2},
+            {"string": "09:00 - 10:00 (**1h00'**) - b", "order": 2},
+        ],
+        None, "today"
+    )
+    assert _strings(entries) == [
+        "08:00 - 09:00 (**1h00'**) - a",
+        "09:00 - 10:00 (**1h00'**) - b",
+        "10:00 - 11:00 (**1h00'**) - c",
+    ]
+    assert [e["order"] for e in entries] == [0, 1, 2]
+    assert fixes == ["today: renumbered orders [2, 2, 5] → 0..2"]
+
+
+# -- tag index ------------------------------------------------------------
+
+HISTORY = [
+    "12:00 - 12:30 (**30'**) - 吃午饭 #[[吃饭]]",
+    "19:00 - 19:40 (**40'**) - 吃晚饭 #[[吃饭]]",
+    "13:00 - 13:30 (**30'**) - 午睡 #[[睡觉]]",
+    "08:00 - 08:30 (**30'**) - 地铁去公司 #[[🚇Commuting]]",
+    "20:00 - 21:00 (**1h00'**) - 刷抖音 #[[🎬Entertainment]]",
+    "09:00 - 09:10 (**10'**) - 没有标签的条目",
+]
+
+
+def _index(tmp_path):
+    index = TagIndex(str(tmp_path / "tags.json"))
+    index.add_day("2026-01-01", HISTORY)
+    return index
+
+
+def test_split_formatted_entry():
+    assert split_activity_and_tags("12:00 - 12:30 (**30'**) - 吃午饭 #[[吃饭]] #[[Personal]]") == (
+        "吃午饭", "#[[吃饭]] #[[Personal]]"
+    )
+
+
+def test_split_strips_raw_time_prefix():
+    assert split_activity_and_tags("9.15 地铁去公司 10点到") == ("地铁去公司 10点到", "")
+    assert split_activity_and_tags("12点-12点半 吃午饭") == ("吃午饭", "")
+    assert split_activity_and_tags("半马训练") == ("半马训练", "")
+
+
+def test_add_day_indexes_tagged_entries_only(tmp_path):
+    index = _index(tmp_path)
+    assert len(index.pairs) == 5
+    assert index.days == {"2026-01-01"}
+
+
+def test_add_day_skips_days_already_indexed(tmp_path):
+    index = _index(tmp_path)
+    assert index.add_day("2026-01-01", HISTORY) == 0
+    assert len(index.pairs) == 5
+
+
+def test_predict_confident_tag(tmp_path):
+    tag, candidates = _index(tmp_path).predict("刷抖音")
+    assert tag == "#[[🎬Entertainment]]"
+    assert candidates[0] == tag
+
+
+def test_predict_candidates_only_when_ambiguous(tmp_path):
+    tag, candidates = _index(tmp_path).predict("午饭")
+    assert tag is None
+    assert "#[[吃饭]]" in candidates
+
+
+def test_predict_nothing_for_unknown_activity(tmp_path):
+    assert _index(tmp_path).predict("xyz") == (None, [])
+
+
+def test_tag_index_save_load_round_trip(tmp_path):
+    index = _index(tmp_path)
+    index.save()
+    loaded = TagIndex.load(index.path)
+    assert loaded.days == index.days
+    assert [tuple(p) for p in loaded.pairs] == index.pairs
+    assert loaded.predict("刷抖音") == index.predict("刷抖音")
+
+
+def test_tag_index_load_missing_file(tmp_path):
+    index = TagIndex.load(str(tmp_path / "missing.json"))
+    assert index.pairs == [] and index.days == set()
+
+
+def test_hinted_tag_applied_by_source_uid(tmp_path):
+    formatter = TimelineFormatter(None)
+    formatter.tag_index = _index(tmp_path)
+    prompt = formatter.get_prompt_for_both_days(
+        [], None, [{"uid": "u1", "content": "20点-21点 刷抖音"}], "T", None
+    )
+    assert "[u1] 20点-21点 刷抖音  → tag: #[[🎬Entertainment]]" in prompt
+
+    # The model reworded the entry; the promised tag still applies
+    result = {"today": [{"string": "20:00 - 21:00 (**1h00'**) - 看短视频", "order": 0, "source": "u1"}]}
+    assert formatter._apply_local_tags(result) == 1
+    assert result["today"][0]["string"].endswith("看短视频 #[[🎬Entertainment]]")
+
+
+# -- journal --------------------------------------------------------------
+
+class FakeRoam:
+    """In-memory stand-in for RoamClient's timeline reads and batch writes."""
+
+    def __init__(self, timelines: dict):
+        self.timelines = timelines
+        self.writes = []
+        self.fail_creates = False
+        self.fail_reads = False
+        self._next_uid = 0
+
+    def get_timeline_entries(self, timeline_uid, strict=False):
+        if self.fail_reads:
+            if strict:
+                raise Exception("Roam API error: unavailable")
+            return []
+        return [dict(e) for e in self.timelines.get(timeline_uid, [])]
+
+    def write(self, action, actions):
+        if self.fail_creates and any(a["action"] == "create-block" for a in actions):
+            raise Exception("Roam API error: create failed")
+        self.writes.append(actions)
+        for a in actions:
+            if a["action"] == "delete-block":
+                for uid, entries in self.timelines.items():
+                    self.timelines[uid] = [e for e in entries if e["uid"] != a["block"]["uid"]]
+            else:
+                self._next_uid += 1
+                self.timelines[a["location"]["parent-uid"]].append({
+                    "uid": f"new-{self._next_uid}",
+                    "content": a["block"]["string"],
+                    "order": a["location"]["order"],
+                })
+
+
+NEW_ENTRIES = [
+    {"string": "08:30 - 09:00 (**30'**) - 吃早饭 #[[吃饭]]", "order": 0, "day": "today"},
+    {"string": "09:00 - 10:00 (**1h00'**) - 地铁去公司 #[[🚇Commuting]]", "order": 1, "day": "today"},
+]
+
+
+@pytest.fixture
+def half_applied(tmp_path):
+    """A run whose delete batch went through and whose create batch failed."""
+    roam = FakeRoam({"T": [
+        {"uid": "old-1", "content": "8.30 吃早饭", "order": 0},
+        {"uid": "old-2", "content": "9点 地铁", "order": 1},
+    ]})
+    formatter = TimelineFormatter(roam)
+    journal = TimelineJournal.for_date(datetime(2026, 1, 17), str(tmp_path))
+    journal.record_snapshot("today", "T", roam.get_timeline_entries("T"))
+
+    roam.fail_creates = True
+    assert not formatter._execute_batch_actions([dict(a) for a in NEW_ENTRIES], "T", None, journal)
+    roam.fail_creates = False
+    return formatter, roam, journal
+
+
+def test_journal_keeps_only_the_failed_create_pending(half_applied):
+    _, roam, journal = half_applied
+    assert roam.timelines["T"] == []
+    assert [journal.batches[i]["kind"] for i in journal.pending_batches()] == ["create"]
+
+    reloaded = TimelineJournal.load(journal.path)
+    assert reloaded.pending_batches() == journal.pending_batches()
+    assert reloaded.data["snapshot"]["today"]["entries"][0]["uid"] == "old-1"
+
+
+def test_resume_sends_only_missing_creates(half_applied):
+    formatter, roam, journal = half_applied
+    # Pretend the first create landed before the failure was reported
+    roam.timelines["T"].append({"uid": "x", "content": NEW_ENTRIES[0]["string"], "order": 0})
+    roam.writes.clear()
+
+    assert formatter.resume(TimelineJournal.load(journal.path))
+    assert roam.writes == [[{
+        "action": "create-block",
+        "location": {"parent-uid": "T", "order": 1},
+        "block": {"string": NEW_ENTRIES[1]["string"]},
+    }]]
+    assert TimelineJournal.load(journal.path).pending_batches() == []
+
+
+def test_resume_stops_when_timeline_fetch_fails(half_applied):
+    formatter, roam, journal = half_applied
+    roam.fail_reads = True
+    roam.writes.clear()
+
+    assert not formatter.resume(journal)
+    assert roam.writes == []
+    assert [journal.batches[i]["kind"] for i in journal.pending_batches()] == ["create"]
+
+
+def test_restore_snapshot_rebuilds_original_entries(half_applied):
+    formatter, roam, journal = half_applied
+    assert formatter.restore_snapshot(journal)
+    assert [e["content"] for e in roam.timelines["T"]] == ["8.30 吃早饭", "9点 地铁"]
+    assert journal.pending_batches() == []
+
+
+def test_no_batches_planned_when_existing_fetch_fails(tmp_path):
+    roam = FakeRoam({"T": [{"uid": "old-1", "content": "8.30 吃早饭", "order": 0}]})
+    roam.fail_reads = True
+    formatter = TimelineFormatter(roam)
+    journal = TimelineJournal.for_date(datetime(2026, 1, 17), str(tmp_path))
+
+    assert not formatter._execute_batch_actions([dict(a) for a in NEW_ENTRIES], "T", None, journal)
+    assert journal.batches == []
+    assert roam.writes == []
+
+
+def test_find_unfinished_returns_latest_pending_journal(tmp_path):
+    older = TimelineJournal.for_date(datetime(2026, 1, 16), str(tmp_path))
+    older.plan_batch("today", "create", "T", [])
+    newer = TimelineJournal.for_date(datetime(2026, 1, 17), str(tmp_path))
+    newer.plan_batch("today", "create", "T", [])
+    newer.mark_done(0)
+
+    assert TimelineJournal.find_unfinished(str(tmp_path)).path == older.path
+
+
+def test_format_today_refuses_while_a_run_is_unfinished(half_applied, monkeypatch):
+    formatter, roam, journal = half_applied
+    monkeypatch.setattr(TimelineJournal, "find_unfinished", classmethod(lambda cls, *a: journal))
+
+    def no_roam(*args, **kwargs):
+        raise AssertionError("format_today must not touch Roam")
+
+    formatter.roam.get_daily_page_uid = no_roam
+    formatter._call_model = no_roam
+
+    assert formatter.format_today() is False
+    assert [journal.batches[i]["kind"] for i in journal.pending_batches()] == ["create"]